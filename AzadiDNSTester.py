@@ -7,18 +7,112 @@ Requires: pip install dnspython tqdm
 """
 
 import re
+import array
+import errno
 import os
+import pickle
 import sys
 import time
+import heapq
+import random
+import struct
 import socket
-import threading
-import dns.resolver
+import selectors
+import dns.message
+import dns.rcode
+import dns.rdatatype
 import dns.exception
 from tqdm import tqdm
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
-file_lock = threading.Lock()
+# Canonical octets only (0-255, no leading zeros), so every match is a valid address as-is
+_OCTET = rb'(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])'
+_QUAD = rb'(?:' + _OCTET + rb'\.){3}' + _OCTET
+
+# Compiled once at import and run over raw file bytes. The lookarounds reject quads that
+# are part of a longer dotted run (1.2.3.4.5, OIDs); a sentence-ending dot is fine.
+# The leading (?=[0-9]) matches nothing new but lets re skip ahead to the next digit
+# instead of trying the lookbehinds at every byte, which halves the scan time.
+_IP_RE = re.compile(rb'(?=[0-9])(?<![0-9])(?<![0-9]\.)' + _QUAD + rb'(?![0-9]|\.[0-9])')
+
+# Files are scanned in windows of about this many bytes, cut at a newline
+_SCAN_WINDOW = 1 << 20
+
+# Result codes. The detail slot holds the first A rdata (OK), the rcode (RCODE_ERROR),
+# the error name (DNS_ERROR/ERROR) or the timeout (TIMEOUT); text is built only when shown.
+# Codes are stored in the result cache, so they keep their values (1 was the preflight's).
+OK = 0
+NXDOMAIN = 2
+NO_ANSWER = 3
+RCODE_ERROR = 4
+DNS_ERROR = 5
+TIMEOUT = 6
+ERROR = 7
+
+# Results are reused across runs for this long (seconds)
+_CACHE_FILE = '.dns_cache.pkl'
+_CACHE_TTL = 300
+
+# Flag OR-ed into a result code when the outcome came from the cache
+_CACHED = 0x100
+
+# Only outcomes decided by an actual reply are cached; timeouts and local errors
+# (e.g. no route to host) say more about this run's network than about the server
+_CACHEABLE = frozenset({OK, NXDOMAIN, NO_ANSWER,
+                        RCODE_ERROR, DNS_ERROR})
+
+def _ipv4_to_int(ip):
+    """Convert a dotted-quad IPv4 address to a uint32"""
+    return struct.unpack('>I', socket.inet_aton(ip))[0]
+
+def _int_to_ipv4(ip):
+    """Format a uint32 IPv4 address as dotted-quad (only needed at the I/O boundary)"""
+    return socket.inet_ntoa(struct.pack('>I', ip))
+
+def _error_name(e):
+    """Name an exception by its errno (OS errors) or type, so outcomes don't keep it alive"""
+    if isinstance(e, OSError) and e.errno in errno.errorcode:
+        return errno.errorcode[e.errno]
+    return type(e).__name__
+
+def _scan_windows(content):
+    """Yield the IPv4 matches of content one window at a time
+
+    findall runs in C, which a per-match finditer loop can't match, and windows keep the
+    full candidate list from ever existing. A newline can't be part of a match or its
+    lookarounds, so cutting there changes nothing.
+    """
+    pos, size = 0, len(content)
+    while pos < size:
+        end = content.find(b'\n', pos + _SCAN_WINDOW)
+        if end < 0:
+            end = size
+        yield _IP_RE.findall(content, pos, end)
+        pos = end
+
+def _unique_ipv4s(content):
+    """Dedup IPv4 addresses in raw file bytes in file order; returns (uint32 array, total count)
+
+    Each window is packed to uint32 and its new addresses appended right away, so only
+    the ints themselves are kept; no full-size list of byte strings is ever built.
+    """
+    total = 0
+    seen = set()
+    add = seen.add
+    servers = array.array('I')
+    for matches in _scan_windows(content):
+        if not matches:
+            continue
+        
+        total += len(matches)
+        # Matches are canonical, so inet_aton can't fail or read an octet as octal.
+        # One join/split/map keeps the conversion loop in C.
+        packed = array.array('I')
+        packed.frombytes(b''.join(map(socket.inet_aton, b'\n'.join(matches).decode('ascii').split('\n'))))
+        if sys.byteorder == 'little':
+            packed.byteswap()  # inet_aton returns network (big-endian) order
+        servers.extend([ip for ip in packed if not (ip in seen or add(ip))])
+    return servers, total
 
 def get_script_dir():
     """Get directory where script is located"""
@@ -51,22 +145,20 @@ def create_sample_servers(filename='dns_servers.txt'):
         print(f"Error creating {filename}: {e}")
 
 def load_servers(filename='dns_servers.txt'):
-    """Load ALL IPv4 addresses from file - format doesn't matter"""
+    """Load ALL IPv4 addresses from file - format doesn't matter
+
+    Returns an array.array('I') of uint32 addresses: 4 bytes each instead of a str object.
+    """
     filepath = os.path.join(get_script_dir(), filename)
     try:
-        with open(filepath, 'r') as f:
+        with open(filepath, 'rb') as f:
             content = f.read()
         
-        ip_pattern = re.compile(
-            r'\b(?:(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.){3}'
-            r'(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\b'
-        )
-        
-        all_ips = ip_pattern.findall(content)
-        servers = list(set(all_ips))
+        # Validated once here, so testers can trust every entry; file order is kept
+        servers, total_ips = _unique_ipv4s(content)
         
         print(f"Extracted {len(servers)} UNIQUE IPv4 addresses from {filepath}")
-        print(f"Total IPs found (with duplicates): {len(all_ips)}")
+        print(f"Total IPs found (with duplicates): {total_ips}")
         print(f"UNIQUE IPs:  {len(servers)}")
         
         if not servers:
@@ -89,26 +181,74 @@ def write_header(test_domain):
     filepath = os.path.join(get_script_dir(), 'working_dns.txt')
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     
-    with file_lock:
-        try:
-            with open(filepath, 'w') as f:
-                f.write(f"# Working DNS servers - Tested: {timestamp}\n")
-                f.write(f"# Test domain: {test_domain}\n")
-                f.write("# Format: IP (response_time_ms)\n")
-            print("Header written to working_dns.txt")
-        except Exception as e:
-            print(f"Header write error: {e}")
-
-def real_time_save(server_info):
-    """Thread-safe real-time save of working servers (append only)"""
+    try:
+        with open(filepath, 'w') as f:
+            f.write(f"# Working DNS servers - Tested: {timestamp}\n")
+            f.write(f"# Test domain: {test_domain}\n")
+            f.write("# Format: IP (response_time_ms)\n")
+        print("Header written to working_dns.txt")
+    except Exception as e:
+        print(f"Header write error: {e}")
+
+def open_results_file():
+    """Open working_dns.txt once for appending (O_APPEND makes each write one atomic append)
+
+    Returns None if the file can't be opened, so testing still runs without saving.
+    """
     filepath = os.path.join(get_script_dir(), 'working_dns.txt')
+    flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+    try:
+        return os.open(filepath, flags, 0o644)
+    except OSError as e:
+        print(f"Results file open error: {e}")
+        return None
+
+def real_time_save(fd, server_info):
+    """Real-time save of working servers (single unbuffered write, no lock needed)"""
+    if fd is None:
+        return
     
-    with file_lock:
-        try:
-            with open(filepath, 'a') as f:
-                f.write(f"{server_info}\n")
-        except Exception as e:
-            print(f"Real-time save error: {e}")
+    try:
+        os.write(fd, f"{server_info}{os.linesep}".encode())
+    except OSError as e:
+        print(f"Real-time save error: {e}")
+
+def load_cache():
+    """Load recent test results from the on-disk cache, dropping expired entries"""
+    filepath = os.path.join(get_script_dir(), _CACHE_FILE)
+    try:
+        with open(filepath, 'rb') as f:
+            cache = pickle.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"Ignoring unreadable cache: {e}")
+        return {}
+    
+    now = time.time()
+    return {key: entry for key, entry in cache.items() if now - entry[0] < _CACHE_TTL}
+
+def clear_cache():
+    """Delete the on-disk result cache"""
+    filepath = os.path.join(get_script_dir(), _CACHE_FILE)
+    try:
+        os.remove(filepath)
+        print("Cache cleared")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Cache clear error: {e}")
+
+def save_cache(cache):
+    """Write the result cache atomically (temp file + os.replace)"""
+    filepath = os.path.join(get_script_dir(), _CACHE_FILE)
+    tmp_path = f"{filepath}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, filepath)
+    except Exception as e:
+        print(f"Cache save error: {e}")
 
 def get_worker_count():
     """Get worker count from user with validation"""
@@ -171,44 +311,209 @@ def get_test_domain():
         
         print("Invalid! Use 1-3 or valid domain (e.g., example.com)")
 
-def test_single_server(server, domain, timeout=3):
-    """Test single DNS server with response time"""
-    try:
-        socket.inet_aton(server)
-    except socket.error:
-        return False, (server, None), f"{server} INVALID IP"
+def get_cache_choice(cache, domain, timeout):
+    """Ask whether to reuse cached results for this domain and timeout; returns the cache to use"""
+    cached = sum(1 for key in cache if key[1:] == (domain, timeout))
+    if not cached:
+        return cache
     
-    start_time = time.time()
-    resolver = dns.resolver.Resolver(configure=False)
-    resolver.nameservers = [server]
-    resolver.timeout = timeout
-    resolver.lifetime = timeout
+    while True:
+        print(f"\n{cached} servers were tested with these settings in the last {_CACHE_TTL // 60} minutes:")
+        print("  Enter = reuse those results | r = re-test them | c = clear the whole cache")
+        choice = input("Cache: ").strip().lower()
+        
+        if not choice:
+            return cache
+        
+        if choice == 'r':
+            # Fresh results for this domain/timeout will be cached again as they come in
+            return {key: entry for key, entry in cache.items() if key[1:] != (domain, timeout)}
+        
+        if choice == 'c':
+            clear_cache()
+            return {}
+        
+        print("Invalid! Press Enter, r or c")
+
+def format_result(success, result, code):
+    """Build the display line for a probe outcome (only done for lines actually printed)"""
+    server, response_time, detail, nrecords = result
+    base_code = code & ~_CACHED
+    
+    if base_code == OK:
+        line = f"{server} OK {response_time:.0f}ms ({detail}) - {nrecords} records"
+    elif base_code == NXDOMAIN:
+        line = f"{server} NXDOMAIN ({response_time:.0f}ms)"
+    elif base_code == NO_ANSWER:
+        line = f"{server} NO ANSWER ({response_time:.0f}ms)"
+    elif base_code == RCODE_ERROR:
+        line = f"{server} DNS ERROR ({dns.rcode.to_text(detail)}, {response_time:.0f}ms)"
+    elif base_code == DNS_ERROR:
+        line = f"{server} DNS ERROR ({detail}, {response_time:.0f}ms)"
+    elif base_code == TIMEOUT:
+        line = f"{server} TIMEOUT ({detail}s, {response_time:.0f}ms)"
+    else:
+        line = f"{server} ERROR ({detail}, {response_time:.0f}ms)"
+    
+    if code & _CACHED:
+        line += " (cached)"
+    return f"{'✅' if success else '❌'} {line}"
+
+def parse_reply(server, data, response_time):
+    """Classify a reply from server (caller has already matched its query ID)"""
+    response = dns.message.from_wire(data)
+    rcode = response.rcode()
+    answers = [rr for rrset in response.answer if rrset.rdtype == dns.rdatatype.A for rr in rrset]
+    
+    if rcode == dns.rcode.NXDOMAIN:
+        return False, (server, response_time, None, 0), NXDOMAIN
+    if rcode != dns.rcode.NOERROR:
+        return False, (server, response_time, rcode, 0), RCODE_ERROR
+    if not answers:
+        return False, (server, response_time, None, 0), NO_ANSWER
+    
+    return True, (server, response_time, answers[0], len(answers)), OK
+
+def probe_servers(servers, base_wire, timeout=3, workers=100):
+    """Query all servers from one thread via selectors, yielding results as they complete
+
+    servers holds uint32 addresses; results carry them as dotted-quad strings.
+    Outcomes are (success, (server, response_time, detail, nrecords), code) tuples.
+    Servers are sharded into `workers` interleaved slices. Each slice is walked by its
+    own slot, which owns one unconnected UDP socket reused for every server in it.
+    base_wire is the encoded query; only its 2-byte ID is rewritten per server.
+    Replies from the server's address carrying the ID are classified by parse_reply.
+    Each server first gets half the timeout; if it stays silent the query is resent
+    once for the rest of the budget. Any reply, even NXDOMAIN or REFUSED, is final.
+    """
+    sel = selectors.DefaultSelector()
+    shards = [iter(servers[i::workers]) for i in range(min(workers, len(servers)))]
+    slots = []       # slot -> its socket
+    current = []     # slot -> server being probed, or None when idle
+    in_flight = {}   # server -> (slot, start time, query wire, retried)
+    deadlines = []   # min-heap of (deadline, server); entries for answered servers are skipped
+    question = base_wire[2:]
+    
+    def start_next(slot):
+        """Send the slot's next server its query, yielding errors for any that can't be sent"""
+        sock = slots[slot]
+        for ip in shards[slot]:
+            server = _int_to_ipv4(ip)
+            query_wire = struct.pack('>H', random.getrandbits(16)) + question
+            start_time = time.monotonic()
+            try:
+                # Unconnected: a connect would pin the socket's source address to the route
+                # of the first server, breaking sends to servers reached via other interfaces
+                sock.sendto(query_wire, (server, 53))
+            except OSError as e:
+                yield False, (server, 0, _error_name(e), 0), ERROR
+                continue
+            
+            current[slot] = server
+            in_flight[server] = (slot, start_time, query_wire, False)
+            heapq.heappush(deadlines, (start_time + timeout / 2, server))
+            return
+    
+    def finish(server):
+        slot, start_time, _, _ = in_flight.pop(server)
+        current[slot] = None
+        return slot, (time.monotonic() - start_time) * 1000
     
     try:
-        answers = resolver.resolve(domain, 'A')
-        response_time = (time.time() - start_time) * 1000
-        first_ip = str(answers[0])
-        result = (server, response_time)
-        server_info = f"{server} ({response_time:.0f}ms)"
+        for slot in range(len(shards)):
+            # The kernel assigns each socket a random ephemeral port on its first send
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            sel.register(sock, selectors.EVENT_READ, slot)
+            slots.append(sock)
+            current.append(None)
         
-        real_time_save(server_info)
+        for slot in range(len(slots)):
+            yield from start_next(slot)
         
-        return True, result, f"{server} OK {response_time:.0f}ms ({first_ip}) - {len(answers)} records"
-    except dns.resolver.NXDOMAIN:
-        response_time = (time.time() - start_time) * 1000
-        return False, (server, response_time), f"{server} NXDOMAIN ({response_time:.0f}ms)"
-    except dns.resolver.Timeout:
-        response_time = (time.time() - start_time) * 1000
-        return False, (server, response_time), f"{server} TIMEOUT ({timeout}s, {response_time:.0f}ms)"
-    except dns.resolver.NoAnswer:
-        response_time = (time.time() - start_time) * 1000
-        return False, (server, response_time), f"{server} NO ANSWER ({response_time:.0f}ms)"
-    except dns.exception.DNSException as e:
-        response_time = (time.time() - start_time) * 1000
-        return False, (server, response_time), f"{server} DNS ERROR ({str(e)[:20]}, {response_time:.0f}ms)"
-    except Exception as e:
-        response_time = (time.time() - start_time) * 1000
-        return False, (server, response_time), f"{server} ERROR ({str(e)[:20]}, {response_time:.0f}ms)"
+        while in_flight:
+            wait = min(0.1, max(0, deadlines[0][0] - time.monotonic()))
+            for key, _ in sel.select(wait):
+                slot = key.data
+                server = current[slot]
+                try:
+                    data, source = key.fileobj.recvfrom(512)
+                except OSError:
+                    # ICMP errors (Windows reports them here) can't be tied to one server
+                    # on an unconnected socket; the server just runs into its timeout
+                    continue
+                
+                if server is None:
+                    continue  # leftover datagram on an idle slot
+                
+                _, start_time, query_wire, _ = in_flight[server]
+                response_time = (time.monotonic() - start_time) * 1000
+                if source != (server, 53) or data[:2] != query_wire[:2]:
+                    continue  # stray or late datagram, keep waiting for our answer
+                
+                try:
+                    outcome = parse_reply(server, data, response_time)
+                except dns.exception.DNSException as e:
+                    outcome = False, (server, response_time, _error_name(e), 0), DNS_ERROR
+                except Exception as e:
+                    outcome = False, (server, response_time, _error_name(e), 0), ERROR
+                
+                finish(server)
+                yield outcome
+                yield from start_next(slot)
+            
+            now = time.monotonic()
+            while deadlines and deadlines[0][0] <= now:
+                _, server = heapq.heappop(deadlines)
+                if server not in in_flight:
+                    continue
+                
+                slot, start_time, query_wire, retried = in_flight[server]
+                if not retried:
+                    try:
+                        slots[slot].sendto(query_wire, (server, 53))
+                        in_flight[server] = (slot, start_time, query_wire, True)
+                        heapq.heappush(deadlines, (start_time + timeout, server))
+                        continue
+                    except OSError as e:
+                        slot, response_time = finish(server)
+                        yield False, (server, response_time, _error_name(e), 0), ERROR
+                        yield from start_next(slot)
+                        continue
+                
+                slot, response_time = finish(server)
+                yield False, (server, response_time, timeout, 0), TIMEOUT
+                yield from start_next(slot)
+    finally:
+        for sock in slots:
+            sock.close()
+        sel.close()
+
+def run_tests(servers, base_wire, domain, timeout=3, workers=100, cache=None):
+    """Test servers, answering from cache when a result is fresh and caching new ones
+
+    Entries are keyed by (ip, domain, timeout), so a longer timeout re-tests servers.
+    Only outcomes backed by a reply are cached; silent or unreachable servers are
+    always tested again.
+    """
+    if cache is None:
+        cache = {}
+    
+    now = time.time()
+    misses = array.array('I')
+    for ip in servers:
+        entry = cache.get((ip, domain, timeout))
+        if entry is not None and now - entry[0] < _CACHE_TTL:
+            success, result, code = entry[1]
+            yield success, result, code | _CACHED
+        else:
+            misses.append(ip)
+    
+    for outcome in probe_servers(misses, base_wire, timeout, workers):
+        if outcome[2] in _CACHEABLE:
+            server_ip = outcome[1][0]
+            cache[(_ipv4_to_int(server_ip), domain, timeout)] = (time.time(), outcome)
+        yield outcome
 
 def check_dns_servers(filename='dns_servers.txt'):
     """Main testing function"""
@@ -223,9 +528,13 @@ def check_dns_servers(filename='dns_servers.txt'):
     workers = get_worker_count()
     timeout = get_timeout()
     domain = get_test_domain()
+    cache = get_cache_choice(load_cache(), domain, timeout)
     
     write_header(domain)
     
+    # The domain is fixed for the run, so the query is encoded exactly once
+    base_wire = dns.message.make_query(domain, 'A', use_edns=False).to_wire()
+    
     print(f"\nStarting test of {len(servers)} DNS servers")
     print(f"Config: Workers={workers} | Timeout={timeout}s | Domain={domain}")
     print("Working servers will be SAVED IMMEDIATELY as found!")
@@ -236,33 +545,41 @@ def check_dns_servers(filename='dns_servers.txt'):
     failed = []
     
     print("Testing servers...")
-    with ThreadPoolExecutor(max_workers=workers) as executor:
-        future_to_server = {
-            executor.submit(test_single_server, server, domain, timeout): server 
-            for server in servers
-        }
-        
+    results_fd = open_results_file()
+    
+    try:
         with tqdm(total=len(servers), desc="Progress", unit="server",
                   bar_format="{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]") as pbar:
+            # Terminal output is batched: one write and one bar update per 50 results or 100ms.
+            # Outcomes are buffered raw and only formatted into lines at flush time.
+            outcomes = []
+            last_flush = time.monotonic()
             
-            for future in as_completed(future_to_server):
-                try:
-                    success, result, message = future.result()
-                    server_ip, response_time = result
-                    
-                    if success:
-                        working.append(result)
-                        tqdm.write(f"✅ {message}")
-                    else:
-                        failed.append(server_ip)
-                        tqdm.write(f"❌ {message}")
-                        
-                except Exception as e:
-                    server = future_to_server[future]
-                    failed.append(server)
-                    tqdm.write(f"CRASH {server}: {str(e)[:30]}")
+            for outcome in run_tests(servers, base_wire, domain, timeout, workers, cache):
+                success, result, _ = outcome
+                server_ip, response_time = result[0], result[1]
+                
+                if success:
+                    working.append((server_ip, response_time))
+                    real_time_save(results_fd, f"{server_ip} ({response_time:.0f}ms)")
+                else:
+                    failed.append(server_ip)
+                outcomes.append(outcome)
                 
-                pbar.update(1)
+                if len(outcomes) >= 50 or time.monotonic() - last_flush > 0.1:
+                    tqdm.write("\n".join(format_result(*o) for o in outcomes))
+                    pbar.update(len(outcomes))
+                    outcomes = []
+                    last_flush = time.monotonic()
+            
+            if outcomes:
+                tqdm.write("\n".join(format_result(*o) for o in outcomes))
+                pbar.update(len(outcomes))
+        
+    finally:
+        if results_fd is not None:
+            os.close(results_fd)
+        save_cache(cache)
     
     print("\n" + "="*60)
     print("DNS SERVER TEST RESULTS")
@@ -280,8 +597,8 @@ def check_dns_servers(filename='dns_servers.txt'):
 
     if working:
         print("TOP 5 FASTEST SERVERS:")
-        sorted_working = sorted(working, key=lambda x: x[1])
-        for i, (server_ip, response_time) in enumerate(sorted_working[:5], 1):
+        top5 = heapq.nsmallest(5, working, key=lambda x: x[1])
+        for i, (server_ip, response_time) in enumerate(top5, 1):
             print(f"  {i}. {server_ip:<15} {response_time:.0f}ms")
         if len(working) > 5:
             print(f"  ... {len(working)-5} more servers")